@@ -3,22 +3,28 @@
 FreeAgent Invoice Cache Builder - Catchup Script
 
 Downloads all historical invoices from FreeAgent API incrementally.
-Designed to run via cron job every few minutes, processing 50 invoices at a time.
+Designed to run via cron job every few minutes, processing a small batch of pages
+(8 pages of 100 invoices by default) per run.
 """
 
 import argparse
-import json
+import fcntl
+import gzip
 import logging
 import math
 import os
-import re
+import random
 import sys
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Optional, Tuple
-from urllib.parse import parse_qs, urlparse
+from typing import Dict, List, Mapping, Optional, Set, TextIO, Tuple
+from urllib.parse import quote
 
-import requests
+import httpx
+import orjson
 
 # Configure logging
 logging.basicConfig(
@@ -27,39 +33,206 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO; keep cron logs to our own progress lines
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # Constants
 CONFIG_FILE = "config.json"
 STATE_FILE = "state.json"
+LOCK_FILE = "download_invoices.lock"
 INVOICES_DIR = "data/invoices"
 CREDIT_NOTES_DIR = "data/credit_notes"
+# Output directory and filename prefix for each item type
+TYPE_META = {
+    'invoice': (INVOICES_DIR, 'invoice_'),
+    'credit_note': (CREDIT_NOTES_DIR, 'credit_note_'),
+}
+# Item type for each API collection name in an item URL
+URL_SEGMENT_TYPES = {
+    'invoices': 'invoice',
+    'credit_notes': 'credit_note',
+}
+USER_AGENT = "FreeAgent-Invoice-Cache-Builder/0.1.0"
+DEFAULT_BATCH_SIZE = 8
+MAX_PER_PAGE = 100  # largest page size the FreeAgent API accepts
+DEFAULT_WORKERS = 8  # pages fetched at once within a batch
+MAX_WORKERS = 16  # also the connection pool size, in case the server only speaks HTTP/1.1
+TOKEN_EXPIRY_MARGIN = 60  # seconds before expiry to refresh proactively
+PAGINATION_RECHECK_INTERVAL = 10  # pages between total_pages re-checks
+PAGINATION_END_MARGIN = 5  # always re-check within this many pages of the end
+SHARD_DIGITS = 2  # trailing ID digits used to pick an item's subdirectory
+
+RETRY_ATTEMPTS = 5  # tries per request before giving up until the next cron run
+RETRY_STATUSES = {429, 502, 503, 504}
+RETRY_BACKOFF = 1.0  # seconds, doubled on each retry, plus up to 1s of jitter
+MAX_RETRY_AFTER = 60  # longest Retry-After worth sleeping through in-process
+RATE_LIMIT_RESERVE = 1  # requests left in the rate-limit window before pausing for its reset
+
+# Shared HTTP/2 client. Parallel page fetches are multiplexed as streams over a
+# single TCP/TLS connection rather than one pooled connection per worker, and
+# the token refresh and 401 retry reuse it too. The transport retries failed
+# connection attempts; gateway errors are retried in get_with_retry. httpx
+# sends Accept-Encoding for every decoder it has (gzip, deflate, plus br when
+# the optional brotli package is installed) and decompresses transparently.
+CLIENT = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=True,
+        retries=3,
+        limits=httpx.Limits(max_connections=MAX_WORKERS, max_keepalive_connections=MAX_WORKERS)
+    ),
+    headers={
+        'Accept': 'application/json',
+        'User-Agent': USER_AGENT
+    },
+    timeout=30,
+    follow_redirects=True
+)
+
+
+class RateLimiter:
+    """
+    Pause requests when the API reports its rate limit is nearly used up
+
+    Tracks the latest X-RateLimit-Remaining and X-RateLimit-Reset response
+    headers (reset as a Unix timestamp or as seconds from now). Each request
+    takes one of the remaining slots, so parallel workers can't overshoot the
+    limit between responses. Has no effect when the headers are absent.
+    """
+
+    def __init__(self, reserve: int = RATE_LIMIT_RESERVE):
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._remaining: Optional[int] = None
+        self._reset_at: Optional[float] = None
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Record the rate-limit state reported by a response"""
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = float(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+
+        # Small values are a delay in seconds; large ones are an epoch timestamp
+        reset_at = reset if reset > 1_000_000_000 else time.time() + reset
+        with self._lock:
+            # Responses arrive out of order across workers, so within a window
+            # a late response must not give back slots acquire() has taken.
+            # Only a new window (reset more than a second later, allowing for
+            # jitter in delay-style resets) can raise the allowance.
+            new_window = (
+                self._remaining is None or self._reset_at is None or reset_at > self._reset_at + 1
+            )
+            if new_window:
+                self._remaining = remaining
+                self._reset_at = reset_at
+            else:
+                self._remaining = min(self._remaining, remaining)
+
+    def acquire(self) -> None:
+        """Wait, if needed, until a request can be sent without exceeding the limit"""
+        with self._lock:
+            if self._remaining is None:
+                return
+            if self._remaining > self.reserve:
+                self._remaining -= 1
+                return
+
+            wait = self._reset_at - time.time()
+            if wait <= 0:
+                # Window has reset; the next response reports the new allowance
+                self._remaining = None
+                return
+
+        if wait > MAX_RETRY_AFTER:
+            # Too long to wait in-process; let the 429 handling end the run
+            return
+
+        logger.info(f"Rate limit nearly used up, waiting {wait:.1f}s for it to reset")
+        time.sleep(wait)
+
+
+RATE_LIMITER = RateLimiter()
+
+# Set from --durable: fsync config/state writes before renaming them into place,
+# and sync item directories after each page
+durable_writes = False
+
+# Set from the compress_files config option: save items as gzipped .json.gz files
+compress_files = False
+
+# Serialises token refresh when several pages are fetched in parallel
+TOKEN_LOCK = threading.Lock()
+# Authorization header whose refresh already failed this run (guarded by TOKEN_LOCK),
+# so neither the proactive refresh nor other workers' 401s try it again
+refresh_failed_for: Optional[str] = None
+# Guards the shared set of existing output files across worker threads
+FILES_LOCK = threading.Lock()
+
+
+class CacheBuilderError(Exception):
+    """Base class for errors that end a run; logged and turned into exit_code"""
+    exit_code = 1
+
+
+class FatalConfigError(CacheBuilderError):
+    """Config or state file is missing, invalid or cannot be written"""
+
+
+class AuthFailed(CacheBuilderError):
+    """API rejected our credentials and the token could not be refreshed"""
+
+
+class ApiError(CacheBuilderError):
+    """API returned an unexpected response"""
+
+
+class TransientNetworkError(CacheBuilderError):
+    """Timeout or connection failure; the next cron run will retry"""
+    exit_code = 0
+
+
+class RateLimited(CacheBuilderError):
+    """API rate limit exceeded; the next cron run will retry"""
+    exit_code = 0
+
+    def __init__(self, retry_after: Optional[int]):
+        detail = f", Retry-After {retry_after}s" if retry_after is not None else ""
+        super().__init__(f"Rate limit exceeded (429{detail}). Will retry on next cron run.")
+        self.retry_after = retry_after
 
 
 def load_config() -> Dict:
     """Load API configuration from config.json"""
     if not os.path.exists(CONFIG_FILE):
-        logger.error(f"Configuration file '{CONFIG_FILE}' not found")
-        logger.error(f"Please copy 'config.json.example' to '{CONFIG_FILE}' and add your credentials")
-        sys.exit(1)
+        raise FatalConfigError(
+            f"Configuration file '{CONFIG_FILE}' not found. "
+            f"Please copy 'config.json.example' to '{CONFIG_FILE}' and add your credentials"
+        )
 
     try:
-        with open(CONFIG_FILE, 'r') as f:
-            config = json.load(f)
+        with open(CONFIG_FILE, 'rb') as f:
+            config = orjson.loads(f.read())
 
         # Validate required fields
         required_fields = ['api_base_url', 'access_token', 'refresh_token', 'client_id', 'client_secret', 'per_page', 'nested_invoice_items']
         missing_fields = [field for field in required_fields if field not in config]
         if missing_fields:
-            logger.error(f"Missing required fields in config: {', '.join(missing_fields)}")
-            sys.exit(1)
+            raise FatalConfigError(f"Missing required fields in config: {', '.join(missing_fields)}")
+
+        if config['per_page'] > MAX_PER_PAGE:
+            logger.warning(
+                f"per_page ({config['per_page']}) is above the API maximum of {MAX_PER_PAGE}. "
+                f"Pages may be capped at {MAX_PER_PAGE} items, leaving gaps between pages"
+            )
 
         return config
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in configuration file: {e}")
-        sys.exit(1)
+    except FatalConfigError:
+        raise
+    except orjson.JSONDecodeError as e:
+        raise FatalConfigError(f"Invalid JSON in configuration file: {e}") from e
     except Exception as e:
-        logger.error(f"Error loading configuration: {e}")
-        sys.exit(1)
+        raise FatalConfigError(f"Error loading configuration: {e}") from e
 
 
 def refresh_access_token(config: Dict) -> bool:
@@ -80,17 +253,22 @@ def refresh_access_token(config: Dict) -> bool:
 
     try:
         logger.info("Refreshing expired access token...")
-        response = requests.post(token_endpoint, data=payload, timeout=30)
+        # Client credentials travel in the body, so don't send the stale bearer token
+        request = CLIENT.build_request('POST', token_endpoint, data=payload)
+        request.headers.pop('Authorization', None)
+        response = CLIENT.send(request)
 
         if response.status_code != 200:
             logger.error(f"Token refresh failed: {response.status_code} - {response.text}")
             return False
 
-        data = response.json()
+        data = orjson.loads(response.content)
 
         # Update config with new tokens
         config['access_token'] = data['access_token']
         config['refresh_token'] = data['refresh_token']
+        config['access_token_expires_at'] = int(time.time()) + int(data.get('expires_in', 3600))
+        set_client_token(config)
 
         logger.info("Access token refreshed successfully")
         return True
@@ -100,11 +278,90 @@ def refresh_access_token(config: Dict) -> bool:
         return False
 
 
+def token_expiring(config: Dict) -> bool:
+    """Return True if the access token expires within TOKEN_EXPIRY_MARGIN seconds"""
+    return config.get('access_token_expires_at', 0) - time.time() < TOKEN_EXPIRY_MARGIN
+
+
+def ensure_fresh_token(config: Dict) -> None:
+    """
+    Refresh the access token before it expires
+
+    Avoids spending a request on a guaranteed 401. Configs saved before expiry
+    tracking have no access_token_expires_at, so they refresh once and record it.
+    The 401 handler in fetch_invoices remains the fallback if this fails; a
+    failed refresh is only attempted once per run.
+    """
+    global refresh_failed_for
+
+    if not token_expiring(config):
+        return
+
+    with TOKEN_LOCK:
+        # Another worker may have refreshed while we waited for the lock
+        if not token_expiring(config):
+            return
+
+        current = CLIENT.headers.get('Authorization')
+        if refresh_failed_for == current:
+            return
+
+        logger.info("Access token expires soon, refreshing proactively")
+        if refresh_access_token(config):
+            save_config(config)
+        else:
+            refresh_failed_for = current
+            logger.warning("Proactive token refresh failed, continuing with current token")
+
+
+def set_client_token(config: Dict) -> None:
+    """Set the bearer token sent with every request on the shared client"""
+    CLIENT.headers['Authorization'] = f'Bearer {config["access_token"]}'
+
+
+def write_json_atomic(path: str, data: Dict) -> None:
+    """
+    Write indented JSON to a temporary file and rename it over path
+
+    os.replace is atomic, so a crash mid-write leaves the previous file intact
+    instead of a truncated one. With --durable the data is also fsynced.
+
+    The replacement keeps the existing file's permissions (config.json holds
+    credentials and may be 0600); new files are created owner-only.
+    """
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o600
+
+    tmp_path = path + '.tmp'
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            # Set explicitly: the umask may have masked bits off, and a stale
+            # temp file keeps whatever mode it was created with
+            os.fchmod(f.fileno(), mode)
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+            if durable_writes:
+                f.flush()
+                os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    if durable_writes:
+        sync_directory(os.path.dirname(path) or '.')
+
+
 def save_config(config: Dict) -> None:
     """Persist updated config (including refreshed tokens) to config.json"""
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+        write_json_atomic(CONFIG_FILE, config)
         logger.debug("Config saved successfully")
     except Exception as e:
         logger.error(f"Error saving config: {e}")
@@ -114,30 +371,25 @@ def save_config(config: Dict) -> None:
 def load_state() -> Dict:
     """Load execution state from state.json or create default"""
     if not os.path.exists(STATE_FILE):
-        logger.warning(f"State file '{STATE_FILE}' not found. Run with --initialise first.")
-        sys.exit(1)
+        raise FatalConfigError(f"State file '{STATE_FILE}' not found. Run with --initialise first.")
 
     try:
-        with open(STATE_FILE, 'r') as f:
-            state = json.load(f)
+        with open(STATE_FILE, 'rb') as f:
+            state = orjson.loads(f.read())
         return state
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in state file: {e}")
-        sys.exit(1)
+    except orjson.JSONDecodeError as e:
+        raise FatalConfigError(f"Invalid JSON in state file: {e}") from e
     except Exception as e:
-        logger.error(f"Error loading state: {e}")
-        sys.exit(1)
+        raise FatalConfigError(f"Error loading state: {e}") from e
 
 
 def save_state(state: Dict) -> None:
     """Persist state to state.json"""
     try:
-        with open(STATE_FILE, 'w') as f:
-            json.dump(state, f, indent=2)
+        write_json_atomic(STATE_FILE, state)
         logger.debug(f"State saved successfully")
     except Exception as e:
-        logger.error(f"Error saving state: {e}")
-        sys.exit(1)
+        raise FatalConfigError(f"Error saving state: {e}") from e
 
 
 def initialise_state(config: Dict) -> None:
@@ -146,115 +398,180 @@ def initialise_state(config: Dict) -> None:
         "status": "in_progress",
         "current_page": 0,
         "total_pages": None,
+        "total_pages_checked_at": None,
         "per_page": config['per_page'],
         "last_run": None,
-        "completed_at": None
+        "completed_at": None,
+        "catchup_started_at": None,
+        "page_etags": {}
     }
 
     try:
-        with open(STATE_FILE, 'w') as f:
-            json.dump(default_state, f, indent=2)
+        write_json_atomic(STATE_FILE, default_state)
         logger.info("State initialized successfully")
         logger.info(f"Created '{STATE_FILE}' with current_page=0 and status='in_progress'")
     except Exception as e:
-        logger.error(f"Error initializing state: {e}")
-        sys.exit(1)
+        raise FatalConfigError(f"Error initializing state: {e}") from e
+
 
+def build_page_url_prefix(base_url: str, per_page: int, nested: bool, updated_since: Optional[str] = None) -> str:
+    """
+    Construct the invoice list URL up to and including "page=", so each
+    page's URL is just the prefix plus the page number
 
-def build_api_url(base_url: str, page: int, per_page: int, nested: bool) -> str:
-    """Construct API URL with pagination parameters"""
+    Built once per run. When updated_since (ISO 8601 timestamp) is given,
+    only invoices modified after that time are listed.
+    """
     nested_param = "true" if nested else "false"
-    url = f"{base_url}/invoices?nested_invoice_items={nested_param}&per_page={per_page}&page={page}"
-    return url
+    url = f"{base_url}/invoices?nested_invoice_items={nested_param}&per_page={per_page}"
+    if updated_since:
+        url += f"&updated_since={quote(updated_since, safe='')}"
+    return f"{url}&page="
+
+
+def get_with_retry(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """
+    GET a URL, retrying rate limits, gateway errors and network failures
+
+    Retries up to RETRY_ATTEMPTS times with exponential backoff plus jitter,
+    so parallel workers don't retry in lockstep. A 429 waits for its
+    Retry-After instead, unless that is longer than MAX_RETRY_AFTER, in which
+    case it is returned straight away.
+
+    Returns the last response once retries are exhausted so the caller's
+    status handling still applies; the last network error is re-raised.
+    """
+    for attempt in range(RETRY_ATTEMPTS):
+        last_attempt = attempt == RETRY_ATTEMPTS - 1
+        delay = RETRY_BACKOFF * (2 ** attempt) + random.random()
+
+        RATE_LIMITER.acquire()
+        try:
+            response = CLIENT.get(url, headers=headers)
+        except (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError) as e:
+            if last_attempt:
+                raise
+            logger.warning(f"{type(e).__name__} fetching {url}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        RATE_LIMITER.update(response.headers)
+        if response.status_code not in RETRY_STATUSES or last_attempt:
+            return response
 
+        if response.status_code == 429:
+            retry_after = parse_retry_after(response.headers)
+            if retry_after is not None:
+                if retry_after > MAX_RETRY_AFTER:
+                    return response
+                delay = retry_after
+            logger.warning(f"Rate limit exceeded (429), retrying in {delay:.1f}s")
+        else:
+            logger.warning(f"Gateway error ({response.status_code}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[int]:
+    """Return the Retry-After delay in seconds, or None if missing or not numeric"""
+    try:
+        return max(0, int(headers['Retry-After']))
+    except (KeyError, ValueError):
+        return None
 
-def fetch_invoices(url: str, config: Dict) -> Tuple[Dict, Dict, Dict]:
+
+def fetch_invoices(
+    url: str,
+    config: Dict,
+    etag: Optional[str] = None
+) -> Tuple[Optional[Dict], httpx.Headers, Dict]:
     """
-    Make API call to fetch invoices, with automatic token refresh on 401
+    Make API call to fetch invoices, refreshing the token before it expires
+    and again on 401
+
+    Rate limits and transient failures are retried in-process by
+    get_with_retry; only once those retries run out does the run give up.
+
+    With etag, the request is conditional (If-None-Match) and response_data
+    is None when the server answers 304 Not Modified.
 
     Returns:
         Tuple of (response_data, response_headers, updated_config)
+
+    Raises:
+        RateLimited, TransientNetworkError: retry on the next cron run
+        AuthFailed, ApiError: need attention before the next run can succeed
     """
-    headers = {
-        'Authorization': f'Bearer {config["access_token"]}',
-        'Accept': 'application/json',
-        'User-Agent': 'FreeAgent-Invoice-Cache-Builder/0.1.0'
-    }
+    global refresh_failed_for
+
+    ensure_fresh_token(config)
+    request_headers = {'If-None-Match': etag} if etag else None
 
     try:
         logger.debug(f"Fetching: {url}")
-        response = requests.get(url, headers=headers, timeout=30)
+        response = get_with_retry(url, request_headers)
+        logger.debug(f"Content-Encoding: {response.headers.get('Content-Encoding', 'identity')}")
 
         # Handle rate limiting
         if response.status_code == 429:
-            logger.warning("Rate limit exceeded (429). Will retry on next cron run.")
-            sys.exit(0)
+            raise RateLimited(parse_retry_after(response.headers))
 
         # Handle authentication errors
         if response.status_code == 401:
             logger.warning("Authentication failed (401). Attempting to refresh token...")
 
-            # Try to refresh token
-            if refresh_access_token(config):
-                # Save updated tokens to disk
-                save_config(config)
+            # Another worker may already have refreshed the token while this
+            # request was in flight; only refresh if it was sent with the current
+            # one, and not if refreshing that token has already failed this run
+            with TOKEN_LOCK:
+                sent = response.request.headers.get('Authorization')
+                if sent == refresh_failed_for:
+                    refreshed = False
+                elif sent != CLIENT.headers.get('Authorization'):
+                    refreshed = True
+                elif refresh_access_token(config):
+                    # Save updated tokens to disk
+                    save_config(config)
+                    refreshed = True
+                else:
+                    refresh_failed_for = sent
+                    refreshed = False
 
-                # Retry request with new access token
-                headers['Authorization'] = f'Bearer {config["access_token"]}'
-                response = requests.get(url, headers=headers, timeout=30)
+            if refreshed:
+                # Retry request with new access token (already set on the client)
+                response = get_with_retry(url, request_headers)
 
                 # Check if retry succeeded
+                if response.status_code == 304:
+                    return None, response.headers, config
                 if response.status_code == 200:
-                    data = response.json()
-                    return data, dict(response.headers), config
+                    data = orjson.loads(response.content)
+                    return data, response.headers, config
                 else:
-                    logger.error(f"Request failed even after token refresh: {response.status_code}")
-                    sys.exit(1)
+                    raise AuthFailed(f"Request failed even after token refresh: {response.status_code}")
             else:
-                logger.error("Token refresh failed. Check your refresh_token and client credentials.")
-                sys.exit(1)
+                raise AuthFailed("Token refresh failed. Check your refresh_token and client credentials.")
+
+        # Page unchanged since it was last saved
+        if response.status_code == 304:
+            return None, response.headers, config
 
         # Handle other errors
         if response.status_code != 200:
-            logger.error(f"API request failed with status {response.status_code}: {response.text}")
-            sys.exit(1)
-
-        data = response.json()
-        return data, dict(response.headers), config
-
-    except requests.exceptions.Timeout:
-        logger.error("API request timed out. Will retry on next cron run.")
-        sys.exit(0)
-    except requests.exceptions.ConnectionError:
-        logger.error("Connection error. Will retry on next cron run.")
-        sys.exit(0)
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API request failed: {e}")
-        sys.exit(1)
+            raise ApiError(f"API request failed with status {response.status_code}: {response.text}")
+
+        data = orjson.loads(response.content)
+        return data, response.headers, config
+
+    except CacheBuilderError:
+        raise
+    except httpx.TimeoutException as e:
+        raise TransientNetworkError("API request timed out. Will retry on next cron run.") from e
+    except (httpx.NetworkError, httpx.RemoteProtocolError) as e:
+        raise TransientNetworkError("Connection error. Will retry on next cron run.") from e
+    except httpx.HTTPError as e:
+        raise ApiError(f"API request failed: {e}") from e
     except Exception as e:
-        logger.error(f"Unexpected error during API call: {e}")
-        sys.exit(1)
-
-
-def get_header_case_insensitive(headers: Dict, header_name: str) -> Optional[str]:
-    """
-    Get header value using case-insensitive lookup
-
-    HTTP headers are case-insensitive, but dict.get() is case-sensitive.
-    This helper finds the header regardless of case.
-
-    Args:
-        headers: Dictionary of HTTP headers
-        header_name: Header name to search for (e.g., 'Link', 'X-Total-Count')
-
-    Returns:
-        Header value if found, None otherwise
-    """
-    header_name_lower = header_name.lower()
-    for key, value in headers.items():
-        if key.lower() == header_name_lower:
-            return value
-    return None
+        raise ApiError(f"Unexpected error during API call: {e}") from e
 
 
 def calculate_pages_from_count(total_count: int, per_page: int) -> int:
@@ -281,25 +598,24 @@ def calculate_pages_from_count(total_count: int, per_page: int) -> int:
     return math.ceil(total_count / per_page)
 
 
-def parse_link_header(headers: Dict) -> Optional[int]:
+def parse_link_header(headers: Mapping[str, str]) -> Optional[int]:
     """
     Parse RFC 5988 Link header to extract total pages
 
-    Uses case-insensitive header lookup to find the Link header,
-    then extracts the page number from rel="last" link.
+    Extracts the page number from the rel="last" link.
 
     Example Link header:
     <https://api.freeagent.com/v2/invoices?page=2>; rel="next",
     <https://api.freeagent.com/v2/invoices?page=1860>; rel="last"
 
     Args:
-        headers: Dictionary of HTTP response headers
+        headers: Case-insensitive mapping of HTTP response headers
 
     Returns:
         Total number of pages, or None if not found
     """
-    # Use case-insensitive lookup for Link header
-    link_header = get_header_case_insensitive(headers, 'Link')
+    # response.headers is an httpx.Headers, so this matches any casing
+    link_header = headers.get('Link')
 
     if not link_header:
         logger.debug("No Link header found in response")
@@ -308,63 +624,62 @@ def parse_link_header(headers: Dict) -> Optional[int]:
     logger.debug(f"Link header: {link_header}")
 
     try:
-        # Parse link header for rel="last"
-        # Format: <URL>; rel="last"
-        pattern = r'<([^>]+)>;\s*rel="last"'
-        match = re.search(pattern, link_header)
+        # Find the link with rel="last"
+        # Format: <URL>; rel="next", <URL>; rel="last"
+        last_link = next((part for part in link_header.split(',') if 'rel="last"' in part), None)
 
-        if not match:
+        if last_link is None:
             logger.debug("No rel='last' found in Link header")
             return None
 
-        last_url = match.group(1)
+        last_url = last_link[last_link.index('<') + 1:last_link.index('>')]
         logger.debug(f"Found last page URL: {last_url}")
 
-        # Extract page parameter from URL
-        parsed = urlparse(last_url)
-        params = parse_qs(parsed.query)
-
-        if 'page' not in params:
-            logger.warning("Link header found but no 'page' parameter in URL")
-            return None
-
-        total_pages = int(params['page'][0])
-        logger.info(f"Determined total_pages from Link header: {total_pages}")
-        return total_pages
+        # Extract page parameter from the query string. Match the whole name
+        # so per_page isn't mistaken for page.
+        query = last_url.partition('?')[2]
+        for param in query.split('&'):
+            name, _, value = param.partition('=')
+            if name == 'page':
+                total_pages = int(value)
+                logger.info(f"Determined total_pages from Link header: {total_pages}")
+                return total_pages
+
+        logger.warning("Link header found but no 'page' parameter in URL")
+        return None
 
     except Exception as e:
         logger.error(f"Error parsing Link header: {e}")
         return None
 
 
-def determine_total_pages(headers: Dict, per_page: int, has_data: bool) -> Optional[int]:
+def determine_total_pages(
+    headers: Mapping[str, str],
+    per_page: int,
+    has_data: bool,
+    cached_pages: Optional[int] = None
+) -> Optional[int]:
     """
     Determine total pages using multiple methods with fallback logic
 
     This function tries multiple approaches to determine pagination:
-    1. Parse Link header for rel="last" (primary method)
-    2. Calculate from X-Total-Count header (fallback)
+    1. Calculate from X-Total-Count header (cheapest - a single integer)
+    2. Parse Link header for rel="last" (fallback)
     3. Return None if all methods fail
 
     Args:
-        headers: Dictionary of HTTP response headers
+        headers: Case-insensitive mapping of HTTP response headers
         per_page: Number of items per page
         has_data: Whether the response contains any data
+        cached_pages: total_pages from state; returned without a full Link parse
+            if the rel="last" link still points at it
 
     Returns:
         Total number of pages, or None if it cannot be determined
     """
-    # Layer 1: Try Link header (RFC 5988 standard)
-    logger.debug("Attempting to determine total pages from Link header...")
-    total_pages = parse_link_header(headers)
-
-    if total_pages and total_pages > 0:
-        logger.info(f"Total pages determined from Link header: {total_pages}")
-        return total_pages
-
-    # Layer 2: Try X-Total-Count header (FreeAgent recommended method)
-    logger.debug("Link header method failed, trying X-Total-Count header...")
-    total_count_str = get_header_case_insensitive(headers, 'X-Total-Count')
+    # Layer 1: Try X-Total-Count header (FreeAgent recommended method)
+    logger.debug("Attempting to determine total pages from X-Total-Count header...")
+    total_count_str = headers.get('X-Total-Count')
 
     if total_count_str:
         try:
@@ -376,6 +691,23 @@ def determine_total_pages(headers: Dict, per_page: int, has_data: bool) -> Optio
         except ValueError as e:
             logger.warning(f"Invalid X-Total-Count value '{total_count_str}': {e}")
 
+    # Layer 2: Try Link header (RFC 5988 standard)
+    logger.debug("X-Total-Count method failed, trying Link header...")
+
+    # Most checks find the total unchanged; a substring test confirms that
+    # without splitting the header. The ?/& prefix stops per_page matching.
+    if cached_pages:
+        link_header = headers.get('Link', '')
+        if any(f'{sep}page={cached_pages}>; rel="last"' in link_header for sep in '?&'):
+            logger.debug(f"Link header rel=\"last\" matches cached total_pages: {cached_pages}")
+            return cached_pages
+
+    total_pages = parse_link_header(headers)
+
+    if total_pages and total_pages > 0:
+        logger.info(f"Total pages determined from Link header: {total_pages}")
+        return total_pages
+
     # Layer 3: No pagination info found
     if has_data:
         logger.warning("Could not determine total pages from headers. Defaulting to 1 page.")
@@ -386,66 +718,274 @@ def determine_total_pages(headers: Dict, per_page: int, has_data: bool) -> Optio
         return 1
 
 
-def extract_id_from_url(url: str) -> str:
+def pagination_check_due(state: Dict, next_page: int, batch_size: int) -> bool:
     """
-    Extract ID from invoice/credit note URL
+    Decide whether this run should re-derive total_pages from response headers
 
-    Examples:
-        "https://api.freeagent.com/v2/invoices/694948" -> "694948"
-        "https://api.freeagent.com/v2/credit_notes/694947" -> "694947"
+    total_pages only drifts as invoices are added, so the cached value is reused
+    until the batch nears the end of catchup (where a stale count could finish
+    early) or PAGINATION_RECHECK_INTERVAL pages have passed since the last check.
     """
-    parts = url.rstrip('/').split('/')
-    return parts[-1]
+    total_pages = state.get('total_pages')
+    if not total_pages:
+        return True
+
+    if next_page + batch_size - 1 >= total_pages - PAGINATION_END_MARGIN:
+        return True
 
+    checked_at = state.get('total_pages_checked_at') or 0
+    return next_page - checked_at >= PAGINATION_RECHECK_INTERVAL
 
-def determine_type(url: str) -> str:
+
+def parse_url(url: str) -> Tuple[str, str]:
     """
-    Determine if item is invoice or credit_note from URL
+    Determine item type and extract ID from invoice/credit note URL
+
+    Examples:
+        "https://api.freeagent.com/v2/invoices/694948" -> ("invoice", "694948")
+        "https://api.freeagent.com/v2/credit_notes/694947" -> ("credit_note", "694947")
 
     Returns:
-        "invoice" or "credit_note"
+        Tuple of (item_type, item_id), where item_type is "invoice",
+        "credit_note" or "unknown"
     """
-    if '/credit_notes/' in url:
-        return 'credit_note'
-    elif '/invoices/' in url:
-        return 'invoice'
-    else:
+    path = url.rstrip('/')
+    last_slash = path.rfind('/')
+    prev_slash = path.rfind('/', 0, last_slash)
+    item_id = path[last_slash + 1:]
+
+    # The collection name is the path segment just before the ID
+    item_type = URL_SEGMENT_TYPES.get(path[prev_slash + 1:last_slash])
+    if item_type is None:
         logger.warning(f"Unknown URL type: {url}")
-        return 'unknown'
+        return 'unknown', item_id
+
+    return item_type, item_id
 
 
-def save_item(data: Dict, item_type: str, item_id: str) -> None:
-    """Write JSON file to appropriate directory"""
+def shard_directory(directory: str, item_id: str) -> str:
+    """
+    Return the shard subdirectory of directory that holds item_id
+
+    Items are spread over 100 subdirectories by the last two digits of their
+    ID (invoice 694948 -> data/invoices/48/) so no directory grows unbounded.
+    """
+    return os.path.join(directory, item_id[-SHARD_DIGITS:].zfill(SHARD_DIGITS))
+
+
+def load_existing_files() -> Dict[str, Set[str]]:
+    """
+    Create the output directories and list the files already in them
+
+    Built once per run so save_item can skip downloaded items with a set
+    lookup instead of a stat call per item. Shard directories that do not
+    exist yet are created and added by save_item on first use.
+
+    Returns:
+        Dict mapping each shard directory to the set of filenames in it
+    """
+    existing_files = {}
+    for directory, prefix in TYPE_META.values():
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        flat_files = 0
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    existing_files[entry.path] = set(os.listdir(entry.path))
+                elif entry.name.startswith(prefix):
+                    flat_files += 1
+
+        if flat_files:
+            logger.warning(
+                f"{flat_files} files in '{directory}' use the old unsharded layout and will be "
+                f"downloaded again. Run with --migrate-layout to move them into shard directories."
+            )
+    return existing_files
+
+
+def migrate_layout() -> int:
+    """
+    Move files from the old flat layout (data/invoices/invoice_{ID}.json)
+    into shard directories
+
+    Safe to re-run; files already in a shard are left alone. A flat file
+    whose item has since been downloaded again into its shard is older than
+    that copy, so it is deleted rather than moved over it.
+
+    Returns:
+        Number of files moved
+    """
+    moved = 0
+    for directory, prefix in TYPE_META.values():
+        if not os.path.isdir(directory):
+            continue
+
+        created = set()
+        for name in os.listdir(directory):
+            if not (name.startswith(prefix) and name.endswith(('.json', '.json.gz'))):
+                continue
+
+            shard = shard_directory(directory, name[len(prefix):].split('.', 1)[0])
+            if shard not in created:
+                Path(shard).mkdir(exist_ok=True)
+                created.add(shard)
+            source = os.path.join(directory, name)
+            destination = os.path.join(shard, name)
+            if os.path.exists(destination):
+                os.remove(source)
+                continue
+            os.replace(source, destination)
+            moved += 1
+
+        for shard in created:
+            sync_directory(shard)
+        sync_directory(directory)
+
+    return moved
+
+
+def save_item(
+    data: Dict,
+    item_type: str,
+    item_id: str,
+    existing_files: Dict[str, Set[str]],
+    overwrite: bool = False
+) -> Optional[str]:
+    """
+    Write JSON file to the shard directory for the item
+
+    Items are serialised to compact JSON bytes with orjson (gzipped when
+    compress_files is set) and written with a single os.write; the file is
+    not synced here (see save_page_items). The
+    filename is claimed in existing_files before writing so parallel workers
+    never write it twice. With overwrite, existing files are replaced (used
+    for incremental updates of modified items).
+
+    Returns:
+        Directory the file was written to, or None if nothing was written
+    """
     # Determine directory and filename
-    if item_type == 'invoice':
-        directory = INVOICES_DIR
-        filename = f"invoice_{item_id}.json"
-    elif item_type == 'credit_note':
-        directory = CREDIT_NOTES_DIR
-        filename = f"credit_note_{item_id}.json"
-    else:
+    meta = TYPE_META.get(item_type)
+    if meta is None:
         logger.warning(f"Unknown item type '{item_type}', skipping")
-        return
+        return None
 
-    # Create directory if it doesn't exist
-    Path(directory).mkdir(parents=True, exist_ok=True)
+    type_directory, prefix = meta
+    directory = shard_directory(type_directory, item_id)
+    plain_filename = f"{prefix}{item_id}.json"
+    gzip_filename = plain_filename + '.gz'
+    filename, other_filename = (
+        (gzip_filename, plain_filename) if compress_files else (plain_filename, gzip_filename)
+    )
 
     # Full path
     filepath = os.path.join(directory, filename)
 
-    # Check if file already exists (skip re-download)
-    if os.path.exists(filepath):
-        logger.info(f"Skipped (exists): {filepath}")
-        return
+    # Check if file already exists (skip re-download). A copy saved before
+    # compress_files was changed counts too, rather than downloading it again.
+    with FILES_LOCK:
+        if directory not in existing_files:
+            Path(directory).mkdir(exist_ok=True)
+            existing_files[directory] = set()
+        exists = filename in existing_files[directory]
+        other_exists = other_filename in existing_files[directory]
+        if (exists or other_exists) and not overwrite:
+            logger.info(f"Skipped (exists): {filepath}")
+            return None
+        existing_files[directory].add(filename)
 
     # Write file
     try:
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
-        logger.info(f"Saved: {filepath}")
+        payload = orjson.dumps(data)
+        if compress_files:
+            payload = gzip.compress(payload, mtime=0)
+        # Replacing a good copy goes through a rename, so a crash can't leave a
+        # truncated file that later runs would skip as already downloaded
+        write_file(filepath, payload, replace=exists)
+
+        # Replace rather than keep both copies when the format has changed
+        if other_exists:
+            os.remove(os.path.join(directory, other_filename))
+            with FILES_LOCK:
+                existing_files[directory].discard(other_filename)
+
+        logger.info(f"{'Updated' if exists or other_exists else 'Saved'}: {filepath}")
+        return directory
     except Exception as e:
         logger.error(f"Error saving {filepath}: {e}")
+        if not exists:
+            with FILES_LOCK:
+                existing_files[directory].discard(filename)
         # Continue with other items
+        return None
+
+
+def write_file(filepath: str, payload: bytes, replace: bool = False) -> None:
+    """
+    Write bytes to a file with unbuffered os-level calls
+
+    With replace, the bytes go to a temporary file that is renamed over
+    filepath, so the existing file stays intact until the new one is complete.
+    """
+    target = filepath + '.tmp' if replace else filepath
+    fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+    except BaseException:
+        os.close(fd)
+        if replace:
+            os.remove(target)
+        raise
+    os.close(fd)
+
+    if replace:
+        os.replace(target, filepath)
+
+
+def sync_directory(directory: str) -> None:
+    """Flush a directory's entries to disk so newly created files survive a crash"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug(f"Could not sync directory {directory}: {e}")
+
+
+def save_page_items(items: List[Dict], existing_files: Dict[str, Set[str]], overwrite: bool = False) -> None:
+    """
+    Save every item on a page
+
+    With --durable, each directory written to is synced once afterwards.
+    A page's items spread across many shard directories, so this is not
+    done by default.
+    """
+    written_dirs = set()
+
+    for item in items:
+        url_field = item.get('url')
+        if not url_field:
+            logger.warning("Item missing 'url' field, skipping")
+            continue
+
+        item_type, item_id = parse_url(url_field)
+
+        directory = save_item(item, item_type, item_id, existing_files, overwrite)
+        if directory:
+            written_dirs.add(directory)
+
+    if durable_writes:
+        for directory in written_dirs:
+            sync_directory(directory)
+
+
+def utc_timestamp() -> str:
+    """Return the current UTC time as an ISO 8601 string, e.g. 2026-01-11T18:30:00Z"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
 def calculate_progress(current: int, total: int) -> str:
@@ -456,19 +996,378 @@ def calculate_progress(current: int, total: int) -> str:
     return f"{percentage:.2f}%"
 
 
+def fetch_page(
+    page: int,
+    config: Dict,
+    url_prefix: str,
+    etag: Optional[str] = None
+) -> Tuple[Optional[List[Dict]], httpx.Headers]:
+    """
+    Fetch a single page of invoices without saving them
+
+    url_prefix comes from build_page_url_prefix.
+
+    Returns:
+        Tuple of (items, response_headers); items is None if etag was given
+        and the page has not changed
+    """
+    data, headers, _ = fetch_invoices(url_prefix + str(page), config, etag=etag)
+    if data is None:
+        logger.info(f"Page {page} unchanged since last fetch (304), skipping")
+        return None, headers
+
+    invoices = data.get('invoices', [])
+
+    if not invoices:
+        logger.info(f"No invoices found on page {page}")
+    else:
+        logger.info(f"Found {len(invoices)} items on page {page}")
+
+    return invoices, headers
+
+
+def fetch_and_save_page(
+    page: int,
+    config: Dict,
+    url_prefix: str,
+    existing_files: Dict[str, Set[str]],
+    overwrite: bool = False,
+    etag: Optional[str] = None
+) -> Tuple[int, httpx.Headers]:
+    """
+    Fetch a single page of invoices and save every item on it
+
+    Safe to call from worker threads: each page writes its own files and
+    token refreshes are serialised inside fetch_invoices. With overwrite
+    (used for the updated_since listing), existing files are replaced.
+    A page that comes back 304 for etag is already saved and writes nothing.
+
+    Returns:
+        Tuple of (item_count, response_headers)
+    """
+    invoices, headers = fetch_page(page, config, url_prefix, etag)
+    if invoices is None:
+        return 0, headers
+
+    save_page_items(invoices, existing_files, overwrite=overwrite)
+
+    return len(invoices), headers
+
+
+def fetch_pages_concurrently(
+    pages: range,
+    config: Dict,
+    url_prefix: str,
+    existing_files: Dict[str, Set[str]],
+    completed_pages: Set[int],
+    workers: int = DEFAULT_WORKERS,
+    fetched_page: Optional[Tuple[int, List[Dict]]] = None,
+    page_etags: Optional[Dict[str, str]] = None
+) -> Optional[CacheBuilderError]:
+    """
+    Fetch and save several pages in parallel using a thread pool
+
+    Successfully processed page numbers are added to completed_pages. On the
+    first failure (e.g. rate limiting) the remaining queued pages are cancelled.
+
+    fetched_page is an already fetched (page, items) pair, normally the page
+    used to learn total_pages. Its items are written on the pool while the
+    other pages are downloading, rather than before they start.
+
+    page_etags maps page numbers (as strings) to the ETag of the last saved
+    copy. Pages are requested conditionally against it and it is updated
+    with the ETag of each page that completes.
+
+    Returns:
+        The first error raised by a page, or None if every page succeeded
+    """
+    error = None
+
+    # The save of fetched_page gets a thread of its own so it never holds up a download
+    save_threads = 1 if fetched_page is not None else 0
+    with ThreadPoolExecutor(max_workers=min(len(pages), workers) + save_threads) as executor:
+        futures = {}
+        if fetched_page is not None:
+            page, items = fetched_page
+            futures[executor.submit(save_page_items, items, existing_files)] = page
+        for page in pages:
+            etag = page_etags.get(str(page)) if page_etags is not None else None
+            future = executor.submit(fetch_and_save_page, page, config, url_prefix, existing_files, etag=etag)
+            futures[future] = page
+
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+
+            try:
+                result = future.result()
+                completed_pages.add(futures[future])
+                # The already fetched page's save returns None; its ETag is recorded by the caller
+                if result is not None and page_etags is not None:
+                    record_etag(page_etags, futures[future], result[1])
+            except CacheBuilderError as e:
+                # Stop dispatching but keep what finished; the caller saves
+                # progress before re-raising
+                if error is None:
+                    error = e
+                    logger.warning(f"Page {futures[future]} failed, cancelling remaining pages in batch")
+                for pending in futures:
+                    pending.cancel()
+
+    return error
+
+
+def record_etag(page_etags: Dict[str, str], page: int, headers: Mapping[str, str]) -> None:
+    """Remember the ETag a page was saved with, or forget it if the response had none"""
+    etag = headers.get('ETag')
+    if etag:
+        page_etags[str(page)] = etag
+    else:
+        page_etags.pop(str(page), None)
+
+
+def highest_contiguous_page(current_page: int, completed_pages: Set[int]) -> int:
+    """Return the last page reached from current_page without skipping a gap"""
+    page = current_page
+    while page + 1 in completed_pages:
+        page += 1
+    return page
+
+
+def run_incremental(config: Dict, state: Dict) -> None:
+    """
+    Download invoices created or modified since the last run
+
+    Used after catchup is complete. Pages through the updated_since listing
+    (usually a single page) instead of the full invoice list, replacing any
+    cached files for modified items. The first incremental run goes back to
+    when catchup started, since catchup skips items it already has.
+    """
+    updated_since = state.get('catchup_started_at') or state.get('last_run') or state.get('completed_at')
+    if not updated_since:
+        raise FatalConfigError("No catchup_started_at, last_run or completed_at in state to use for updated_since")
+
+    # Record the start time so changes made while this run is in progress are picked up next time
+    started_at = utc_timestamp()
+    logger.info(f"Fetching invoices updated since {updated_since}")
+
+    existing_files = load_existing_files()
+    url_prefix = build_page_url_prefix(
+        config['api_base_url'], state['per_page'], config['nested_invoice_items'], updated_since
+    )
+    page = 1
+
+    while True:
+        item_count, headers = fetch_and_save_page(page, config, url_prefix, existing_files, overwrite=True)
+        total_pages = determine_total_pages(headers, state['per_page'], item_count > 0) or 1
+        if page >= total_pages:
+            break
+        page += 1
+
+    state['last_run'] = started_at
+    state['catchup_started_at'] = None
+    save_state(state)
+
+    logger.info(f"Incremental update complete. Processed {page} page(s).")
+
+
+def run_catchup(config: Dict, state: Dict, batch_size: int, workers: int = DEFAULT_WORKERS) -> None:
+    """
+    Download the next batch of pages of the full invoice list
+
+    If a page fails, progress up to the last contiguous completed page is
+    saved before the error is re-raised.
+    """
+    # Calculate next page to fetch
+    current_page = state.get("current_page", 0)
+    next_page = current_page + 1
+
+    logger.info(f"Starting to process page {next_page}")
+
+    # Edits made while catchup runs can land on pages it has already saved;
+    # the first incremental run asks for everything changed since this time
+    if not state.get('catchup_started_at'):
+        state['catchup_started_at'] = utc_timestamp()
+
+    existing_files = load_existing_files()
+    url_prefix = build_page_url_prefix(
+        config['api_base_url'], state['per_page'], config['nested_invoice_items']
+    )
+
+    completed_pages = set()
+    error = None
+    page_etags = state.setdefault('page_etags', {})
+
+    if pagination_check_due(state, next_page, batch_size):
+        # Fetch the first page on its own - its headers tell us total_pages.
+        # This request is never conditional, as a 304 may omit pagination headers.
+        items, headers = fetch_page(next_page, config, url_prefix)
+        record_etag(page_etags, next_page, headers)
+
+        # Determine total pages using multiple methods with fallback
+        total_pages = determine_total_pages(
+            headers, state['per_page'], len(items) > 0, cached_pages=state.get('total_pages')
+        )
+
+        if total_pages is None:
+            raise ApiError("Failed to determine total pages from any method. Cannot continue.")
+
+        # Update total_pages in state (moving target)
+        state['total_pages'] = total_pages
+        state['total_pages_checked_at'] = next_page
+
+        # Fetch the rest of the batch concurrently, saving the first page's items meanwhile
+        last_page = min(next_page + batch_size - 1, total_pages)
+
+        if last_page > next_page:
+            logger.info(f"Fetching pages {next_page + 1}-{last_page} of {total_pages} concurrently")
+            error = fetch_pages_concurrently(
+                range(next_page + 1, last_page + 1),
+                config,
+                url_prefix,
+                existing_files,
+                completed_pages,
+                workers,
+                fetched_page=(next_page, items),
+                page_etags=page_etags
+            )
+        else:
+            save_page_items(items, existing_files)
+            completed_pages.add(next_page)
+    else:
+        # total_pages is known and not due a re-check, so nothing needs to
+        # wait for a first response - fetch the whole batch concurrently
+        total_pages = state['total_pages']
+        logger.debug(f"Using cached total_pages: {total_pages}")
+
+        last_page = min(next_page + batch_size - 1, total_pages)
+        logger.info(f"Fetching pages {next_page}-{last_page} of {total_pages} concurrently")
+        error = fetch_pages_concurrently(
+            range(next_page, last_page + 1),
+            config,
+            url_prefix,
+            existing_files,
+            completed_pages,
+            workers,
+            page_etags=page_etags
+        )
+
+    # Only advance past pages with no gaps before them, so a failed page is retried next run
+    processed_page = highest_contiguous_page(current_page, completed_pages)
+
+    # Log progress
+    progress = calculate_progress(processed_page, total_pages)
+    logger.info(f"Processed up to page {processed_page} of {total_pages} ({progress} complete)")
+
+    # Update state after successful processing
+    now = utc_timestamp()
+    state['current_page'] = processed_page
+    state['last_run'] = now
+
+    # Catchup never requests pages at or below current_page again, so only
+    # ETags for pages past it (fetched ahead of a gap) can still be used
+    state['page_etags'] = {
+        page: etag for page, etag in page_etags.items() if int(page) > processed_page
+    }
+
+    # Check if catchup is complete
+    if processed_page >= total_pages:
+        state['status'] = 'catchup_complete'
+        state['completed_at'] = now
+        logger.info(f"Catchup complete! Processed {processed_page} pages.")
+    else:
+        state['status'] = 'in_progress'
+
+    # Save state
+    save_state(state)
+
+    if error is not None:
+        logger.warning(f"Batch stopped early. State saved at page {processed_page}.")
+        raise error
+
+    logger.info("Processing complete. State saved successfully.")
+
+
+def acquire_run_lock() -> Optional[TextIO]:
+    """
+    Take an exclusive, non-blocking lock on LOCK_FILE for the rest of the run
+
+    Retries and rate-limit waits can stretch a run past the cron interval; a
+    second run starting meanwhile would fetch the same pages and race this
+    one on state.json and config.json. The lock is released when the process
+    exits, however it exits.
+
+    Returns:
+        The open lock file (keep a reference to hold the lock), or None if
+        another run holds it
+    """
+    lock_file = open(LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
 def main():
     """Main execution flow"""
     # Parse command-line arguments
     parser = argparse.ArgumentParser(
-        description='Download invoices from FreeAgent API (catchup mode)'
+        description='Download invoices from FreeAgent API (catchup, then optional incremental updates)'
     )
     parser.add_argument(
         '--initialise', '--initialize',
         action='store_true',
         help='Initialize/reset state file'
     )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f'Number of pages to fetch per run (default: {DEFAULT_BATCH_SIZE})'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Number of pages to fetch at once (default: {DEFAULT_WORKERS}, max: {MAX_WORKERS})'
+    )
+    parser.add_argument(
+        '--migrate-layout',
+        action='store_true',
+        help='Move files saved in the old flat layout into shard directories, then exit'
+    )
+    parser.add_argument(
+        '--durable',
+        action='store_true',
+        help='fsync state and config files on every save and sync item directories after each page (slower, survives power loss)'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='After catchup is complete, download invoices updated since the last run'
+    )
     args = parser.parse_args()
 
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if not 1 <= args.workers <= MAX_WORKERS:
+        parser.error(f"--workers must be between 1 and {MAX_WORKERS}")
+
+    run_lock = acquire_run_lock()
+    if run_lock is None:
+        logger.info("Another run is still in progress. Exiting.")
+        return
+
+    global durable_writes
+    durable_writes = args.durable
+
+    if args.migrate_layout:
+        moved = migrate_layout()
+        logger.info(f"Moved {moved} files into shard directories")
+        return
+
     # Handle --initialise flag
     if args.initialise:
         config = load_config()
@@ -478,12 +1377,16 @@ def main():
     # Load configuration and state
     config = load_config()
     state = load_state()
+    set_client_token(config)
+
+    global compress_files
+    compress_files = bool(config.get('compress_files', False))
 
-    # Ensure per_page exists in state (backward compatibility)
+    # Ensure per_page exists in state (backward compatibility); persisted
+    # with the rest of the state at the end of the run
     if 'per_page' not in state:
         logger.warning("State missing per_page, using value from config")
         state['per_page'] = config['per_page']
-        save_state(state)
 
     # Warn if config per_page differs from state per_page
     if state['per_page'] != config['per_page']:
@@ -495,79 +1398,23 @@ def main():
 
     # Check completion status
     if state.get("status") == "catchup_complete":
+        if args.incremental:
+            run_incremental(config, state)
+            return
+
         completed_at = state.get("completed_at", "unknown time")
         logger.info(f"Catchup already complete at {completed_at}. Exiting.")
         return
 
-    # Calculate next page to fetch
-    current_page = state.get("current_page", 0)
-    next_page = current_page + 1
-
-    logger.info(f"Starting to process page {next_page}")
-
-    # Build and execute API request
-    url = build_api_url(
-        config['api_base_url'],
-        next_page,
-        state['per_page'],
-        config['nested_invoice_items']
-    )
-
-    data, headers, config = fetch_invoices(url, config)
-
-    # Process items to check if there's data
-    invoices = data.get('invoices', [])
-    has_data = len(invoices) > 0
-
-    # Determine total pages using multiple methods with fallback
-    total_pages = determine_total_pages(headers, state['per_page'], has_data)
-
-    if total_pages is None:
-        logger.error("Failed to determine total pages from any method. Cannot continue. Exiting.")
-        sys.exit(1)
-
-    # Update total_pages in state (moving target)
-    state['total_pages'] = total_pages
-
-    # Log progress
-    progress = calculate_progress(next_page, total_pages)
-    logger.info(f"Processing page {next_page} of {total_pages} ({progress} complete)")
-
-    # Process items (already extracted above for pagination check)
-
-    if not invoices:
-        logger.info(f"No invoices found on page {next_page}")
-    else:
-        logger.info(f"Found {len(invoices)} items on page {next_page}")
-
-        for item in invoices:
-            url_field = item.get('url')
-            if not url_field:
-                logger.warning("Item missing 'url' field, skipping")
-                continue
-
-            item_id = extract_id_from_url(url_field)
-            item_type = determine_type(url_field)
-
-            save_item(item, item_type, item_id)
-
-    # Update state after successful processing
-    state['current_page'] = next_page
-    state['last_run'] = datetime.utcnow().isoformat() + 'Z'
-
-    # Check if catchup is complete
-    if next_page >= total_pages:
-        state['status'] = 'catchup_complete'
-        state['completed_at'] = datetime.utcnow().isoformat() + 'Z'
-        logger.info(f"Catchup complete! Processed {next_page} pages.")
-    else:
-        state['status'] = 'in_progress'
-
-    # Save state
-    save_state(state)
-
-    logger.info("Processing complete. State saved successfully.")
+    run_catchup(config, state, args.batch_size, args.workers)
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except CacheBuilderError as e:
+        if e.exit_code == 0:
+            logger.warning(str(e))
+        else:
+            logger.error(str(e))
+        sys.exit(e.exit_code)